@@ -1,15 +1,32 @@
-from setuptools import setup, find_packages
+from setuptools import setup, find_packages, Extension
+
+try:
+    from Cython.Build import cythonize
+except ImportError: # the compiled volume kernel is optional
+    ext_modules = []
+else:
+    ext_modules = cythonize([
+        Extension('volpy._volume_kernel',
+                  ['volpy/_volume_kernel.pyx'],
+                  extra_compile_args=['-O3', '-ffast-math'],
+                  optional=True)])
 
 setup(
     name='volpy',
     version='18.12.4',
     packages=find_packages(),
+    ext_modules=ext_modules,
     install_requires=['numpy',
                       'scipy',
                       'pandas',
                       'utm',
                       'sympy',
                       'plotly',],
+    extras_require={
+        'numba': ['numba'],
+        'cupy': ['cupy'],
+        'lxml': ['lxml'],
+    },
 
     package_data={
         'volpy': ['sample_data/survey_ibema_faxinal_Cartesian.csv', ],
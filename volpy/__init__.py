@@ -24,12 +24,11 @@ def demo():
         print('Sample survey data loaded successfully.')
         print("---")
         print("Sample survey information:")
-        print("Maximum elevation: {:.2f} meters.".format(
-            survey.data['elevation'].max()))
+        elevation = survey.data['elevation'].agg(['min', 'max', 'count'])
+        print("Maximum elevation: {:.2f} meters.".format(elevation['max']))
         print("Elevation delta: {:.2f} meters.".format(
-            survey.data['elevation'].max() - survey.data['elevation'].min()))
-        print("Survey data count: {} points.".format(
-            survey.data['elevation'].count()))
+            elevation['max'] - elevation['min']))
+        print("Survey data count: {} points.".format(int(elevation['count'])))
         print("---")
         print("Generating survey plots...")
         plots = terrain_plots(survey)
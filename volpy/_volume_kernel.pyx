@@ -0,0 +1,31 @@
+# cython: boundscheck=False, wraparound=False, cdivision=True
+# Compiled mesh volume kernel. Built by setup.py when Cython is available;
+# geometry falls back to the Numba or NumPy kernels otherwise.
+from cython cimport floating
+from libc.math cimport fabs
+from libc.stdint cimport int64_t
+
+
+cpdef double mesh_volume(const floating[:, ::1] points,
+                         const int64_t[:, ::1] simplices) noexcept nogil:
+    """
+    Returns the volume between a triangular mesh and the XY plane.
+
+    :param points: (N, 3) C-contiguous array of x, y, z coordinates.
+    :param simplices: (M, 3) C-contiguous array of point indices forming
+                      each triangle.
+    """
+    cdef Py_ssize_t i
+    cdef int64_t a, b, c
+    cdef double area, mean_z
+    cdef double volume = 0.0
+    for i in range(simplices.shape[0]):
+        a = simplices[i, 0]
+        b = simplices[i, 1]
+        c = simplices[i, 2]
+        area = 0.5 * fabs(
+            (points[b, 0] - points[a, 0]) * (points[c, 1] - points[a, 1]) -
+            (points[c, 0] - points[a, 0]) * (points[b, 1] - points[a, 1]))
+        mean_z = (points[a, 2] + points[b, 2] + points[c, 2]) / 3.0
+        volume += area * mean_z
+    return volume
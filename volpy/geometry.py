@@ -1,15 +1,81 @@
 import numpy as np
-from sympy import symbols
-from sympy import integrate
 from scipy.spatial import Delaunay
 import pandas as pd
-import plotly
-import plotly.offline as po
-import plotly.graph_objs as go
-from plotly import tools
 
 from .coordinates import CartesianCoordinate
-from .utils import print_progress
+
+try:
+    from numba import njit, prange
+except ImportError: # numba is optional: pip install volpy[numba]
+    njit = None
+
+
+def _projected_areas(A, B, C):
+    """
+    Returns the area of each triangle ABC projected onto the XY plane.
+
+    :param A, B, C: (N, 3) arrays of x, y, z coordinates for each vertex.
+    """
+    return 0.5 * np.abs((B[:, 0] - A[:, 0]) * (C[:, 1] - A[:, 1]) -
+                        (C[:, 0] - A[:, 0]) * (B[:, 1] - A[:, 1]))
+
+def _mesh_volume_numpy(points, simplices):
+    """
+    Returns the volume between a triangular mesh and the XY plane.
+
+    :param points: (N, 3) array of x, y, z coordinates.
+    :param simplices: (M, 3) array of point indices forming each triangle.
+    """
+    # Each triangle casts a prism onto the XY plane whose volume is its
+    # projected area times the mean height of its vertices.
+    A = points[simplices[:, 0]]
+    B = points[simplices[:, 1]]
+    C = points[simplices[:, 2]]
+    # Products are taken in float64, as the compiled kernels do, so float32
+    # points do not lose precision before the cut/fill int truncation.
+    area = _projected_areas(A, B, C).astype(np.float64)
+    mean_z = (A[:, 2] + B[:, 2] + C[:, 2]).astype(np.float64) / 3.0
+    return float((area * mean_z).sum())
+
+if njit is not None:
+    @njit(parallel=True, fastmath=True, cache=True)
+    def _mesh_volume_numba(points, simplices):
+        """Numba compiled equivalent of _mesh_volume_numpy."""
+        volume = 0.0
+        for i in prange(simplices.shape[0]):
+            a = simplices[i, 0]
+            b = simplices[i, 1]
+            c = simplices[i, 2]
+            area = 0.5 * abs(
+                (points[b, 0] - points[a, 0]) * (points[c, 1] - points[a, 1]) -
+                (points[c, 0] - points[a, 0]) * (points[b, 1] - points[a, 1]))
+            mean_z = (points[a, 2] + points[b, 2] + points[c, 2]) / 3.0
+            volume += area * mean_z
+        return volume
+else:
+    _mesh_volume_numba = None
+
+try:
+    from ._volume_kernel import mesh_volume as _mesh_volume_compiled
+except ImportError: # compiled kernel is only available on built releases
+    _mesh_volume_compiled = None
+
+# Fastest kernel available: compiled extension, then Numba, then NumPy.
+_mesh_volume = (_mesh_volume_compiled or
+                _mesh_volume_numba or
+                _mesh_volume_numpy)
+
+# Number of (triangle, ref_level) values get_volume_curves works on at once.
+_CURVE_BLOCK_SIZE = 2 ** 22
+
+def compute_normals(A, B, C):
+    """
+    Returns the normal vectors AB x BC for a batch of triangles.
+
+    :param A, B, C: (N, 3) arrays of x, y, z coordinates for each vertex,
+                    e.g. points[simplices[:, 0]].
+    """
+    return np.cross(B - A, C - B)
 
 class Line2D():
     """A 2-Dimensional line"""
@@ -35,8 +101,7 @@ class Line2D():
             slope = (self.point_B.y - self.point_A.y) /\
                     (self.point_B.x - self.point_A.x)
             linear_constant = -slope*self.point_A.x + self.point_A.y
-            x = symbols('x')
-            return slope*x + linear_constant
+            return lambda x: slope*x + linear_constant
 
 class Triangle():
     """A triangle in a 3D Cartesian Coordinates System"""
@@ -50,28 +115,31 @@ class Triangle():
 
     def get_plane_equation(self):
         """
-        Returns the plane equation constants for the plane that contains points
-        A, B and C.
+        Returns a callable z=f(x, y): the plane that contains points A, B
+        and C.
         Plane equation: a*(x-xo) + b*(y-yo) + c*(z-zo) = 0
         """
-        vector_AB = self.point_B - self.point_A
-        vector_BC = self.point_C - self.point_B
-        normal_vector = np.cross(vector_AB, vector_BC)
+        A, B, C = [np.array([[point.x, point.y, point.z]])
+                   for point in (self.point_A, self.point_B, self.point_C)]
+        normal_vector = compute_normals(A, B, C)[0]
         a = normal_vector[0]
         b = normal_vector[1]
         c = normal_vector[2]
         xo = self.point_A.x
         yo = self.point_A.y
         zo = self.point_A.z
-        x, y = symbols('x y') # z = f(x, y)
-        return ((-a*(x-xo)-b*(y-yo))/c)+zo
+        return lambda x, y: ((-a*(x-xo)-b*(y-yo))/c)+zo
 
     def get_volume(self):
         """
         Returns the volume from the polyhedron generated by triangle ABC and
         the XY plane
         """
-        plane = self.get_plane_equation()
+        from sympy import symbols
+        from sympy import integrate
+
+        x, y = symbols('x y')
+        plane = self.get_plane_equation()(x, y)
         # Define how to compute a double integral
         def compute_double_integral(outer_boundary_from,
                                     outer_boundary_to,
@@ -79,16 +147,21 @@ class Triangle():
                                     line_to_equation):
             if ((line_from_equation is None) or (line_to_equation is None)):
                 return 0.0 # vertical line
-            x, y = symbols('x y')
             volume =  integrate(plane,
-                                (y, line_from_equation, line_to_equation),
+                                (y, line_from_equation(x), line_to_equation(x)),
                                 (x, outer_boundary_from, outer_boundary_to))
             return volume
 
-        # Instantiate lines. Points are sorted on the x coordinate.
-        points = [self.point_A, self.point_B, self.point_C]
-        points.sort()
-        sorted_point_A, sorted_point_B, sorted_point_C = points
+        # Instantiate lines. Points are sorted on the x coordinate with a
+        # 3-element sorting network.
+        sorted_point_A, sorted_point_B, sorted_point_C = (
+            self.point_A, self.point_B, self.point_C)
+        if sorted_point_A.x > sorted_point_B.x:
+            sorted_point_A, sorted_point_B = sorted_point_B, sorted_point_A
+        if sorted_point_B.x > sorted_point_C.x:
+            sorted_point_B, sorted_point_C = sorted_point_C, sorted_point_B
+        if sorted_point_A.x > sorted_point_B.x:
+            sorted_point_A, sorted_point_B = sorted_point_B, sorted_point_A
         lineAB = Line2D(sorted_point_A, sorted_point_B)
         lineBC = Line2D(sorted_point_B, sorted_point_C)
         lineAC = Line2D(sorted_point_A, sorted_point_C)
@@ -110,19 +183,40 @@ class Triangle():
 
 class TriangularMesh(object):
 
-    def __init__(self, point_cloud):
+    def __init__(self, point_cloud, precision='float32'):
         """
         :param point_cloud: a pandas dataframe containing x, y, z, elevation
+        :param precision: floating point type used for the volume math.
+                          Volumes are always accumulated in float64 and the
+                          triangulation always runs on float64.
+                          (default) 'float32'.
         :attr data: a numpy array representing the triangular mesh of points
                     generated using a Delaunay triangulation.
                     Not set by the user.
         """
         self.point_cloud = point_cloud
+        self.dtype = np.dtype(precision)
         self.data = Delaunay(point_cloud[['x', 'y']]).simplices
-        self._flat_volume = {0.0: 0.0} # dictionary containing ref_level and
-        # corresponding flat volume. Used by the cut and fill routines.
-        # Defined as an attribute to reduce the need to recalculate
-        # CONSIDER CREATING additional dictionaries to allow faster performance on new calculations for the same point_cloud
+        # (x, y) projection the cached triangulation was computed for.
+        # Cut, fill and flat volumes only change z, so they reuse it.
+        self._xy = point_cloud[['x', 'y']].to_numpy(dtype=np.float64)
+        self._simplices = self.data.astype(np.int64)
+        # point_cloud (x, y) at a local origin in the mesh precision, and its
+        # triangulation. The cut, fill and flat routines only change z, so
+        # they build their points from these directly.
+        self._local_xy = (self._xy - self._xy.min(axis=0)).astype(self.dtype)
+        self._mesh_simplices = self._simplices
+        # Projected area of the mesh. A flat surface at ref_level holds
+        # _total_area * ref_level.
+        triangles = self._local_xy[self._mesh_simplices]
+        self._total_area = float(_projected_areas(
+            triangles[:, 0], triangles[:, 1], triangles[:, 2]
+        ).astype(np.float64).sum())
+        # Sorted ref_levels and their corresponding flat volumes. Used by the
+        # cut and fill routines. Defined as attributes to reduce the need to
+        # recalculate.
+        self._flat_levels = np.array([0.0])
+        self._flat_vols = np.array([0.0])
         self.triangular_areas = len(self.data)
 
     def get_volume(self, data_points='Default', show_progress=True):
@@ -130,48 +224,88 @@ class TriangularMesh(object):
         Returns the volume.
 
         :param data_points: (pandas DataFrame) a subset of the point_cloud
-                            parameter that initializes with this class. The
-                            reason it is given as an input is to reuse this
-                            get_volume method to calculate cut and fill volumes.
+                            parameter that initializes with this class, or a
+                            (numpy array) of x, y, z rows. The reason it is
+                            given as an input is to reuse this get_volume
+                            method to calculate cut and fill volumes.
                             (default) the hole point_cloud.
-        :param show_progress: (bool) shows the progress bar when True.
+        :param show_progress: (bool) kept for backwards compatibility. The
+                              volume is computed for all triangles at once.
+        """
+        if isinstance(data_points, np.ndarray):
+            points = np.asarray(data_points, dtype=np.float64)
+        else:
+            if type(data_points) is not pd.core.frame.DataFrame:
+                data_points=self.point_cloud
+            points = self._as_xyz(data_points)
+        simplices = self._get_simplices(points[:, :2])
+        return float(_mesh_volume(self._to_local(points), simplices))
+
+    def _get_simplices(self, xy):
+        """
+        Returns the Delaunay triangulation for the given (x, y) projection,
+        reusing the cached one when the projection has not changed.
+        """
+        if not np.array_equal(xy, self._xy):
+            # Keep a private copy: xy may be a view of the caller's array.
+            self._xy = xy.copy()
+            self._simplices = Delaunay(xy).simplices.astype(np.int64)
+        return self._simplices
+
+    def _as_xyz(self, df=None):
+        """
+        Returns the x, y, z columns of df as an (N, 3) float64 numpy array.
+
+        :param df: (pandas DataFrame) (default) the point_cloud.
+        """
+        if df is None:
+            df = self.point_cloud
+        return df[['x', 'y', 'z']].to_numpy(dtype=np.float64, copy=False)
+
+    def _to_local(self, points):
+        """
+        Returns float64 x, y, z rows as a C-contiguous array in the mesh
+        precision, with (x, y) moved to a local origin first. Projected areas
+        do not change under translation, while UTM scale coordinates would
+        lose about half a meter of resolution when downcast to float32.
         """
-        if type(data_points) is not pd.core.frame.DataFrame:
-            data_points=self.point_cloud
-
-        data = Delaunay(data_points[['x', 'y']]).simplices # I think I can remove this. Do it after done with the corresponding cut/fill unit tests.
-        mesh_volume = 0
-        iteration = 0
-        data_amount = len(data)
-        for i in range(data_amount):
-            A = data_points.iloc[data[i][0]]
-            B = data_points.iloc[data[i][1]]
-            C = data_points.iloc[data[i][2]]
-            point_A = CartesianCoordinate(A['x'], A['y'], A['z'])
-            point_B = CartesianCoordinate(B['x'], B['y'], B['z'])
-            point_C = CartesianCoordinate(C['x'], C['y'], C['z'])
-            triangle = Triangle(point_A, point_B, point_C)
-            volume = triangle.get_volume()
-            mesh_volume += volume
-
-            # update progress bar
-            if show_progress:
-                iteration += 1
-                print_progress(iteration,
-                            data_amount,
-                            prefix='Progress:',
-                            suffix='Complete',
-                            length = 50)
-        return mesh_volume
+        origin = np.zeros(3)
+        origin[:2] = points[:, :2].min(axis=0)
+        return np.ascontiguousarray(points - origin, dtype=self.dtype)
+
+    def _get_local_points(self, z):
+        """
+        Returns the point_cloud at the local (x, y) origin in the mesh
+        precision, with z replaced by the given values.
+        """
+        points = np.empty((len(z), 3), dtype=self.dtype)
+        points[:, :2] = self._local_xy
+        points[:, 2] = z
+        return points
+
+    def _get_volume_at(self, z):
+        """
+        Returns the volume of the point_cloud mesh with z replaced by the
+        given values.
+        """
+        points = self._get_local_points(z)
+        return float(_mesh_volume(points, self._mesh_simplices))
 
     def _get_flat_volume(self, ref_level):
         """
-        Sets the internal attribute for flat_volume.
+        Returns the flat volume at ref_level, calculating and storing it on
+        the internal flat volume attributes when not yet available.
         """
-        data_flat = self.point_cloud.copy(deep=True)
-        data_flat['z'] = ref_level
-        self._flat_volume[ref_level] = self.get_volume(
-            data_flat, show_progress=False)
+        index = np.searchsorted(self._flat_levels, ref_level)
+        # ref_levels are floats: match the stored neighbours within epsilon.
+        for neighbour in (index - 1, index):
+            if (0 <= neighbour < len(self._flat_levels) and
+                    abs(self._flat_levels[neighbour] - ref_level) < 1e-9):
+                return self._flat_vols[neighbour]
+        flat_volume = self._total_area * ref_level
+        self._flat_levels = np.insert(self._flat_levels, index, ref_level)
+        self._flat_vols = np.insert(self._flat_vols, index, flat_volume)
+        return flat_volume
 
     def get_cut_volume(self, ref_level, show_progress=True):
         """
@@ -181,12 +315,9 @@ class TriangularMesh(object):
         :param ref_level: the reference level to be used. This is relative to
         the lowest point available in z.
         """
-        data_cut = self.point_cloud.copy(deep=True)
-        data_cut.loc[data_cut['z'] < ref_level, 'z'] = ref_level
-        if ref_level not in self._flat_volume.keys():
-            self._get_flat_volume(ref_level)
-        flat_volume = self._flat_volume[ref_level]
-        full_cut = self.get_volume(data_cut, show_progress=show_progress)
+        z = np.maximum(self.point_cloud['z'].to_numpy(), ref_level)
+        flat_volume = self._get_flat_volume(ref_level)
+        full_cut = self._get_volume_at(z)
         return np.int64(full_cut - flat_volume)
 
     def get_fill_volume(self, ref_level, show_progress=True):
@@ -199,19 +330,12 @@ class TriangularMesh(object):
         """
         if ref_level == 0.0: return 0.0 # quick exit when ref is 0.0.
 
-        data_fill = self.point_cloud.copy(deep=True)
-        data_fill.loc[data_fill['z'] >= ref_level, 'z'] = ref_level
-        if ref_level not in self._flat_volume.keys():
-            self._get_flat_volume(ref_level)
-        flat_volume = self._flat_volume[ref_level]
-        full_fill = self.get_volume(data_fill, show_progress=show_progress)
+        z = np.minimum(self.point_cloud['z'].to_numpy(), ref_level)
+        flat_volume = self._get_flat_volume(ref_level)
+        full_fill = self._get_volume_at(z)
         return np.int64(flat_volume - full_fill)
 
-
-    # Create TEST CASES for cut and fill volumes. Keep in mind how you are
-    # flattening the projection to make sure the numbers match.
-
-    def get_volume_curves(self, step=1.0):
+    def get_volume_curves(self, step=1.0, backend='numpy'):
         """
         Returns a pandas DataFrame representing containing the following
         columns:
@@ -222,30 +346,63 @@ class TriangularMesh(object):
         surveyed terrain at varing ref_levels.
 
         :param step: the increase in ref_level at each iteration
+        :param backend: (str) 'numpy' or 'cupy'. 'cupy' runs the
+                        (triangles, levels) sweep on the GPU and falls back
+                        to 'numpy' when cupy is not installed.
         """
+        if backend == 'numpy':
+            xp = np
+        elif backend == 'cupy':
+            try:
+                import cupy as xp
+            except ImportError: # cupy is optional: pip install volpy[cupy]
+                xp = np
+        else:
+            raise ValueError("Unknown backend. Expected 'numpy' or 'cupy'.")
+
         z_max = self.point_cloud['z'].max()
         z_min = 0
         levels = np.arange(z_min, z_max, step)
 
-        iterations = len(levels)-1
-        iteration = 0
-        curves = []
-
-        integrals = self.triangular_areas * 3 * 2 * iterations
-        print("Please hold while I calculate {} double integrals.".format(
-            integrals))
-
-        for ref_level in levels:
-            cut = self.get_cut_volume(ref_level, show_progress=False)
-            fill = self.get_fill_volume(ref_level, show_progress=False)
-            curves.append([ref_level, cut, fill])
-            print_progress(iteration,
-                           iterations,
-                           prefix='Progress:',
-                           suffix='Complete',
-                           length = 50)
-            iteration += 1
-
+        # Clipping z at a ref_level only changes each triangle's mean height,
+        # so the volumes for every level come out of (triangles, levels)
+        # broadcasts over the same triangulation.
+        points = self._get_local_points(self.point_cloud['z'].to_numpy())
+        simplices = self._mesh_simplices
+        A = points[simplices[:, 0]]
+        B = points[simplices[:, 1]]
+        C = points[simplices[:, 2]]
+        area = _projected_areas(A, B, C).astype(np.float64)
+        zs = np.stack((A[:, 2], B[:, 2], C[:, 2]), axis=1)
+        flat = self._total_area * levels
+
+        area = xp.asarray(area)
+        zs = xp.asarray(zs)
+        levels_z = xp.asarray(levels, dtype=self.dtype)
+        full_cut = np.empty(len(levels))
+        full_fill = np.empty(len(levels))
+        # Levels are swept in blocks so the (triangles, levels) temporaries
+        # stay around _CURVE_BLOCK_SIZE values however large the mesh is.
+        block = max(1, _CURVE_BLOCK_SIZE // max(1, len(area)))
+        for first in range(0, len(levels), block):
+            block_levels = levels_z[first:first + block]
+            cut_heights = xp.zeros((len(area), len(block_levels)))
+            fill_heights = xp.zeros((len(area), len(block_levels)))
+            for vertex in range(3):
+                z = zs[:, vertex, None]
+                cut_heights += xp.maximum(z, block_levels)
+                fill_heights += xp.minimum(z, block_levels)
+            block_cut = area @ cut_heights / 3.0
+            block_fill = area @ fill_heights / 3.0
+            if xp is not np:
+                block_cut = xp.asnumpy(block_cut)
+                block_fill = xp.asnumpy(block_fill)
+            full_cut[first:first + block] = block_cut
+            full_fill[first:first + block] = block_fill
+
+        curves = {'ref_level': levels,
+                  'cut': (full_cut - flat).astype(np.int64),
+                  'fill': (flat - full_fill).astype(np.int64)}
         columns = ['ref_level', 'cut', 'fill']
         return pd.DataFrame(data=curves, columns=columns)
 
@@ -256,6 +413,9 @@ class TriangularMesh(object):
         :param curves: (pandas DataFrame) a collection of volume curves data.
                        Expected columns: ref_level, cut, fill, swell_cut
         """
+        import plotly.offline as po
+        import plotly.graph_objs as go
+
         layout = go.Layout(title='Volume Curves',
                            autosize=True,
                            xaxis=dict(title='Reference level (meters)'),
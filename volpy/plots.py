@@ -1,5 +1,4 @@
 import numpy as np
-from sympy import symbols
 import plotly
 import plotly.offline as po
 import plotly.graph_objs as go
@@ -115,15 +114,13 @@ class SurveyPlot():
         current_color = 1
 
         triangular_mesh = TriangularMesh(self.survey.data)
-        data_amount = len(triangular_mesh.data)
+        points = triangular_mesh.point_cloud[['x', 'y']].to_numpy()
+        vertices = points[triangular_mesh.data] # (triangles, 3, 2)
         data = []
-        for i in range(data_amount):
-            A = triangular_mesh.point_cloud.iloc[triangular_mesh.data[i][0]]
-            B = triangular_mesh.point_cloud.iloc[triangular_mesh.data[i][1]]
-            C = triangular_mesh.point_cloud.iloc[triangular_mesh.data[i][2]]
+        for triangle in vertices:
             trace = go.Scatter(
-                x=[A['x'], B['x'], C['x']],
-                y=[A['y'], B['y'], C['y']],
+                x=triangle[:, 0],
+                y=triangle[:, 1],
                 mode='markers',
                 marker=dict(
                     size=4,
@@ -1,9 +1,64 @@
+import numpy as np
 import pandas as pd
 import os
-from xml.dom.minidom import parse
+import mmap
+import xml.etree.ElementTree as ET
 from .coordinates import CoordinateSystem
 from .coordinates import UtmCoordinate
 
+try:
+    from lxml import etree
+except ImportError: # lxml is optional: pip install volpy[lxml]
+    etree = None
+
+# GPX files from this size on are memory mapped instead of read through a
+# buffered file. Below it, setting up the mapping costs more than it saves.
+_MMAP_MIN_SIZE = 8 * 1024 * 1024
+
+
+def _iter_track_points(source):
+    """
+    Yields the trkpt elements of a GPX file as they are parsed. Each element
+    is released once the caller moves on to the next one, so the whole
+    document is never held in memory.
+
+    :param source: path to the GPX file.
+    """
+    with open(source, 'rb') as file:
+        if os.fstat(file.fileno()).st_size >= _MMAP_MIN_SIZE:
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                yield from _parse_track_points(data)
+        else:
+            yield from _parse_track_points(file)
+
+def _parse_track_points(file):
+    """
+    Yields the trkpt elements parsed from a file-like object.
+
+    Uses the C-backed lxml parser, which filters trkpt tags itself, when
+    available and the standard library parser otherwise.
+    """
+    if etree is not None:
+        for _, element in etree.iterparse(file,
+                                          events=('end',),
+                                          tag='{*}trkpt'):
+            yield element
+            element.clear(keep_tail=True)
+            while element.getprevious() is not None:
+                del element.getparent()[0]
+    else:
+        segment = None
+        for event, element in ET.iterparse(file, events=('start', 'end')):
+            if element.tag.endswith('trkseg'):
+                segment = element if event == 'start' else None
+            elif event == 'end' and element.tag.endswith('trkpt'):
+                yield element
+                element.clear()
+                # ElementTree has no parent links: detach the point from the
+                # segment being parsed so processed points are not retained.
+                if segment is not None:
+                    segment.remove(element)
+
 
 class Survey():
     """
@@ -69,9 +124,7 @@ class Survey():
         Returns a tuple with the maximum values for x, y, z available on the
         survey data
         """
-        x_max = self.data['x'].max()
-        y_max = self.data['y'].max()
-        z_max = self.data['z'].max()
+        x_max, y_max, z_max = self.data[['x', 'y', 'z']].max()
         print("x={}; y={}; z={}".format(x_max, y_max, z_max))
         return (x_max, y_max, z_max)
 
@@ -83,50 +136,46 @@ class Survey():
         successful and None otherwise.
         """
 
-        # Parsing XML file
-        collection = parse(self.source).documentElement
-        track_points = collection.getElementsByTagName("trkpt")
-        if len(track_points) == 0:
-            raise ValueError("Unexpected trackpoint tag on XML file")
-        points = []
+        # Parsing XML file. Values are kept as raw strings and converted once
+        # per column after parsing.
+        latitudes = []
+        longitudes = []
+        elevations = []
+
+        for element in _iter_track_points(self.source):
+            namespace = element.tag[:-len('trkpt')]
 
-        for point in track_points:
             # Parse from XML
-            latitude = point.getAttribute("lat")
-            longitude = point.getAttribute("lon")
-            elevation = point.getElementsByTagName('ele')[0]\
-                .childNodes[0].data
+            latitude = element.get("lat")
+            longitude = element.get("lon")
+            elevation = element.findtext(namespace + 'ele')
 
             if (not latitude or
                 not longitude or
                 not elevation):
                 raise ValueError("Unexpected tag for lat/lon/ele.")
 
-            try:
-                latitude = pd.to_numeric(latitude)
-                longitude = pd.to_numeric(longitude)
-                elevation = pd.to_numeric(elevation)
-                utm = UtmCoordinate.create_from_geographic(
-                    latitude,
-                    longitude,
-                    elevation)
-                entry = (latitude,
-                        longitude,
-                        utm.elevation,
-                        utm.northing,
-                        utm.easting)
-                points.append(entry)
-            except Exception as exception:
-                raise exception
+            latitudes.append(latitude)
+            longitudes.append(longitude)
+            elevations.append(elevation)
+
+        if len(latitudes) == 0:
+            raise ValueError("Unexpected trackpoint tag on XML file")
+
+        # Convert data
+        latitudes = pd.to_numeric(latitudes).astype(np.float64)
+        longitudes = pd.to_numeric(longitudes).astype(np.float64)
+        elevations = pd.to_numeric(elevations).astype(np.float64)
+        utm = UtmCoordinate.create_from_geographic(latitudes,
+                                                   longitudes,
+                                                   elevations)
 
         # Generate DataFrame
-        columns = ['latitude',
-                   'longitude',
-                   'elevation',
-                   'northing',
-                   'easting']
-        data = pd.DataFrame.from_records(points,
-                                         columns=columns)
+        data = pd.DataFrame({'latitude': latitudes,
+                             'longitude': longitudes,
+                             'elevation': utm.elevation,
+                             'northing': utm.northing,
+                             'easting': utm.easting})
 
         # Generate x, y, z
         data['x'] = data['easting'] - data['easting'].min()
@@ -1,12 +1,15 @@
+import sys
 import pytest
 import numpy as np
-from sympy import symbols
+import pandas as pd
 
 from .coordinates import CartesianCoordinate
 from .coordinates import CoordinateSystem
 from .geometry import Line2D
 from .geometry import Triangle
+from . import geometry
 from .geometry import TriangularMesh
+from .geometry import compute_normals
 from .survey import Survey
 
 """
@@ -38,8 +41,7 @@ def test_2dLine(point_A, point_B, input_x, output_y):
         output_y_calculated = None
         assert output_y == output_y_calculated
     else:
-        x = symbols('x')
-        output_y_calculated = float(line_equation.subs(x, input_x))
+        output_y_calculated = line_equation(input_x)
         assert output_y == pytest.approx(output_y_calculated, abs=0.01)
 
 """
@@ -81,10 +83,17 @@ test_cases = (
 def test_plane_equation(point_A, point_B, point_C, input_y, input_x, output_z):
     triangle = Triangle(point_A, point_B, point_C)
     plane = triangle.get_plane_equation()
-    x, y = symbols('x y')
-    output_z_calculated = float(plane.subs([(x, input_x), (y, input_y)]))
+    output_z_calculated = plane(input_x, input_y)
     assert output_z_calculated == pytest.approx(output_z, abs=0.01)
 
+"""Test batched normal vectors match the cross product of each triangle"""
+def test_compute_normals():
+    A, B, C = np.random.RandomState(0).uniform(0, 10, size=(3, 20, 3))
+    normals = compute_normals(A, B, C)
+    for i in range(len(normals)):
+        expected = np.cross(B[i] - A[i], C[i] - B[i])
+        assert np.allclose(normals[i], expected)
+
 """
 Test volume of a triangle is calculated as expected.
 """
@@ -153,10 +162,174 @@ def test_mesh_volume():
     expected_volume = 168.0-(13.0*4.0*1.0)
     assert mesh.get_volume() == pytest.approx(expected_volume, rel=0.01)
 
+def test_mesh_volume_matches_triangles():
+    source = 'sample_data/survey_delaunay_Cartesian.csv'
+    survey = Survey(source,
+                    'sample',
+                    coordinate_system=CoordinateSystem.CARTESIAN)
+    mesh = TriangularMesh(survey.data)
+    expected_volume = 0.0
+    for simplex in mesh.data:
+        vertices = [CartesianCoordinate(*survey.data.iloc[i][['x', 'y', 'z']])
+                    for i in simplex]
+        expected_volume += float(Triangle(*vertices).get_volume())
+    assert mesh.get_volume() == pytest.approx(expected_volume, rel=1e-6)
+
+"""Test the cached triangulation notices in place changes to an array input"""
+def test_mesh_volume_array_modified_in_place():
+    source = 'sample_data/survey_ibema_faxinal_Cartesian.csv'
+    survey = Survey(source,
+                    'sample',
+                    coordinate_system=CoordinateSystem.CARTESIAN)
+    mesh = TriangularMesh(survey.data, precision='float64')
+    points = survey.data[['x', 'y', 'z']].to_numpy(dtype=np.float64)[:100]
+    mesh.get_volume(points)
+    points[:, :2] = np.random.RandomState(0).uniform(0, 10, (len(points), 2))
+    expected_volume = TriangularMesh(
+        pd.DataFrame(points, columns=['x', 'y', 'z']),
+        precision='float64').get_volume()
+    assert mesh.get_volume(points) == pytest.approx(expected_volume)
+
+"""Test single precision volumes agree with double precision ones"""
+def test_mesh_volume_precision():
+    source = 'sample_data/survey_ibema_faxinal_Cartesian.csv'
+    survey = Survey(source,
+                    'sample',
+                    coordinate_system=CoordinateSystem.CARTESIAN)
+    single = TriangularMesh(survey.data)
+    double = TriangularMesh(survey.data, precision='float64')
+    assert single.get_volume() == pytest.approx(double.get_volume(), rel=1e-6)
+
+"""Test single precision stays accurate on UTM scale (x, y) coordinates"""
+def test_mesh_volume_precision_large_coordinates():
+    source = 'sample_data/survey_ibema_faxinal_Cartesian.csv'
+    survey = Survey(source,
+                    'sample',
+                    coordinate_system=CoordinateSystem.CARTESIAN)
+    data = survey.data.copy()
+    data['x'] += 460564.0
+    data['y'] += 7242060.0
+    single = TriangularMesh(data)
+    double = TriangularMesh(data, precision='float64')
+    assert single.get_volume() == pytest.approx(double.get_volume(), rel=1e-6)
+    assert single.get_cut_volume(10.0) == pytest.approx(
+        double.get_cut_volume(10.0), abs=1)
+    assert single.get_fill_volume(10.0) == pytest.approx(
+        double.get_fill_volume(10.0), abs=1)
+    curves = single.get_volume_curves() - double.get_volume_curves()
+    assert curves.abs().max().max() <= 1
+
+"""Test the cached triangulation is only reused for the same projection"""
+def test_mesh_volume_subset():
+    source = 'sample_data/survey_ibema_faxinal_Cartesian.csv'
+    survey = Survey(source,
+                    'sample',
+                    coordinate_system=CoordinateSystem.CARTESIAN)
+    mesh = TriangularMesh(survey.data)
+    subset = survey.data.iloc[:100]
+    expected_volume = TriangularMesh(subset).get_volume()
+    assert mesh.get_volume(subset) == pytest.approx(expected_volume)
+    assert mesh.get_volume() == pytest.approx(
+        TriangularMesh(survey.data).get_volume())
+
+"""Run volume tests against every available kernel"""
+kernels = [(name, kernel) for name, kernel in
+           [('numpy', geometry._mesh_volume_numpy),
+            ('numba', geometry._mesh_volume_numba),
+            ('compiled', geometry._mesh_volume_compiled)]
+           if kernel is not None]
+
+@pytest.fixture(params=[kernel for _, kernel in kernels],
+                ids=[name for name, _ in kernels])
+def kernel(request, monkeypatch):
+    monkeypatch.setattr(geometry, '_mesh_volume', request.param)
+    return request.param
+
+"""Test each volume kernel agrees with a per-triangle reference"""
+def test_mesh_volume_kernel(kernel):
+    from scipy.spatial import Delaunay
+    points = np.random.RandomState(0).uniform(0, 100, size=(500, 3))
+    simplices = Delaunay(points[:, :2]).simplices.astype(np.int64)
+    expected = 0.0
+    for a, b, c in simplices:
+        A, B, C = points[a], points[b], points[c]
+        area = 0.5 * abs((B[0] - A[0]) * (C[1] - A[1]) -
+                         (C[0] - A[0]) * (B[1] - A[1]))
+        expected += area * (A[2] + B[2] + C[2]) / 3.0
+    assert kernel(points, simplices) == pytest.approx(expected, rel=1e-9)
+    single = np.ascontiguousarray(points, dtype=np.float32)
+    assert kernel(single, simplices) == pytest.approx(expected, rel=1e-6)
+
 """Test Cut and Fill Volumes"""
-# RESUME HERE
-def test_cut_volume():
-    assert 1 == 1
+def inclined_plane():
+    """
+    A 10x10 grid on the z=x plane. Grid nodes sit on every integer x, so no
+    triangle crosses an integer ref_level and volumes are exact.
+    """
+    x, y = np.meshgrid(np.arange(11.0), np.arange(11.0))
+    return pd.DataFrame({'x': x.ravel(), 'y': y.ravel(), 'z': x.ravel()})
+
+test_cases = (('ref_level', 'expected_cut', 'expected_fill'),
+[
+    (0.0, 500, 0),
+    (4.0, 180, 80),
+    (10.0, 0, 500),
+])
+
+@pytest.mark.parametrize(*test_cases)
+def test_cut_volume(kernel, ref_level, expected_cut, expected_fill):
+    mesh = TriangularMesh(inclined_plane())
+    assert mesh.get_cut_volume(ref_level) == expected_cut
+
+@pytest.mark.parametrize(*test_cases)
+def test_fill_volume(kernel, ref_level, expected_cut, expected_fill):
+    mesh = TriangularMesh(inclined_plane())
+    assert mesh.get_fill_volume(ref_level) == expected_fill
+
+"""Test the volume curves match cut and fill volumes at each ref_level"""
+def test_volume_curves(monkeypatch):
+    source = 'sample_data/survey_ibema_faxinal_Cartesian.csv'
+    survey = Survey(source,
+                    'sample',
+                    coordinate_system=CoordinateSystem.CARTESIAN)
+    mesh = TriangularMesh(survey.data)
+    curves = mesh.get_volume_curves(step=2.0)
+    assert list(curves.columns) == ['ref_level', 'cut', 'fill']
+    monkeypatch.setattr(geometry, '_CURVE_BLOCK_SIZE', len(mesh.data) * 3)
+    blocked_curves = mesh.get_volume_curves(step=2.0)
+    pd.testing.assert_frame_equal(blocked_curves, curves)
+    with pytest.raises(ValueError):
+        mesh.get_volume_curves(step=2.0, backend='unknown')
+    for _, row in curves.iterrows():
+        assert row['cut'] == pytest.approx(
+            mesh.get_cut_volume(row['ref_level']), abs=1)
+        assert row['fill'] == pytest.approx(
+            mesh.get_fill_volume(row['ref_level']), abs=1)
+
+"""Test the CuPy backend computes the same volume curves on the GPU"""
+def test_volume_curves_cupy():
+    pytest.importorskip('cupy')
+    source = 'sample_data/survey_ibema_faxinal_Cartesian.csv'
+    survey = Survey(source,
+                    'sample',
+                    coordinate_system=CoordinateSystem.CARTESIAN)
+    mesh = TriangularMesh(survey.data)
+    curves = mesh.get_volume_curves(step=2.0)
+    gpu_curves = mesh.get_volume_curves(step=2.0, backend='cupy')
+    assert np.abs(gpu_curves.values - curves.values).max() <= 1
+
+"""Test the CuPy backend falls back to NumPy when cupy is not installed"""
+def test_volume_curves_cupy_fallback(monkeypatch):
+    monkeypatch.setitem(sys.modules, 'cupy', None) # import cupy fails
+    mesh = TriangularMesh(inclined_plane())
+    pd.testing.assert_frame_equal(
+        mesh.get_volume_curves(step=2.0, backend='cupy'),
+        mesh.get_volume_curves(step=2.0))
 
-def test_fill_volume():
-    assert 1 == 1
+"""Test flat volumes are stored sorted and reused for close ref_levels"""
+def test_flat_volume_cache():
+    mesh = TriangularMesh(inclined_plane())
+    assert mesh._get_flat_volume(0.3 * 3) == pytest.approx(90.0)
+    assert mesh._get_flat_volume(0.5) == pytest.approx(50.0)
+    assert mesh._get_flat_volume(0.9) == pytest.approx(90.0)
+    assert list(mesh._flat_levels) == pytest.approx([0.0, 0.5, 0.9])
@@ -3,6 +3,7 @@
 import pytest
 import pandas as pd
 
+from . import survey as survey_module
 from .survey import Survey
 from .coordinates import CoordinateSystem
 sample_directory = 'sample_data/'
@@ -78,3 +79,50 @@ def test_import_error(source, error_type, coordinate_system):
         source = sample_directory + source
         with pytest.raises(error_type):
             _ = Survey(source, 'sample', coordinate_system)
+
+# Memory mapped GPX parsing
+def test_mmap_gpx_import(monkeypatch):
+        source = sample_directory + 'survey_ibema_faxinal.gpx'
+        expected = Survey(source, 'sample', CoordinateSystem.GEOGRAPHIC)
+        monkeypatch.setattr(survey_module, '_MMAP_MIN_SIZE', 0)
+        survey = Survey(source, 'sample', CoordinateSystem.GEOGRAPHIC)
+        pd.testing.assert_frame_equal(survey.data, expected.data)
+
+# Standard library GPX parsing, used when lxml is not installed
+gpx_sources = ['survey_ibema_faxinal.gpx', 'survey_se_brusque.gpx']
+
+@pytest.mark.parametrize('source', gpx_sources)
+def test_stdlib_gpx_import(source, monkeypatch):
+        source = sample_directory + source
+        expected = Survey(source, 'sample', CoordinateSystem.GEOGRAPHIC)
+        monkeypatch.setattr(survey_module, 'etree', None)
+        survey = Survey(source, 'sample', CoordinateSystem.GEOGRAPHIC)
+        pd.testing.assert_frame_equal(survey.data, expected.data)
+
+@pytest.mark.parametrize('source', ['survey_ibema_faxinal_corrupt.gpx',
+                                    'survey_ibema_faxinal_unexpectedLat.gpx',
+                                    'survey_ibema_faxinal_unexpectedTrackPoint.gpx'])
+def test_stdlib_gpx_import_error(source, monkeypatch):
+        monkeypatch.setattr(survey_module, 'etree', None)
+        with pytest.raises(ValueError):
+            _ = Survey(sample_directory + source,
+                       'sample',
+                       CoordinateSystem.GEOGRAPHIC)
+
+def test_stdlib_gpx_releases_track_points(monkeypatch):
+        monkeypatch.setattr(survey_module, 'etree', None)
+        iterparse = survey_module.ET.iterparse
+        retained = []
+
+        def recording_iterparse(*args, **kwargs):
+            for event, element in iterparse(*args, **kwargs):
+                if event == 'end' and element.tag.endswith('trkseg'):
+                    retained.append(len(element))
+                yield event, element
+
+        monkeypatch.setattr(survey_module.ET, 'iterparse', recording_iterparse)
+        _ = Survey(sample_directory + 'survey_se_brusque.gpx',
+                   'sample',
+                   CoordinateSystem.GEOGRAPHIC)
+        # Track points are detached once read, so a closing segment is empty.
+        assert retained == [0]